@@ -1,14 +1,25 @@
-import boto3
 import logging
 import json
-from api.logging_config import setup_logging
 
-setup_logging()
-# Initialize SQS client
-sqs = boto3.client('sqs')
+_sqs = None
+
+# Create the SQS client on first use so importing this module stays cheap on cold start
+def get_sqs_client():
+    global _sqs
+    if _sqs is None:
+        import boto3
+        _sqs = boto3.client('sqs')
+    return _sqs
+
+# Keep `sqs` available as a module attribute without creating the client at import time
+def __getattr__(name):
+    if name == 'sqs':
+        return get_sqs_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def send_to_queue(request_body):
     queue_name = request_body.get('queueName')
+    sqs = get_sqs_client()
     try:
         # Attempt to get the queue URL
         response = sqs.get_queue_url(QueueName=queue_name)
@@ -1,9 +1,6 @@
-from jsonschema import validate, ValidationError
 import json
 import logging
-from api.logging_config import setup_logging
 
-setup_logging()
 # Define JSON schema for the Widget Request
 WIDGET_REQUEST_SCHEMA = {
     "type": "object",
@@ -29,10 +26,22 @@ WIDGET_REQUEST_SCHEMA = {
     "required": ["queueName", "requestId", "widgetId"]
 }
 
+_validator = None
+
+# Import jsonschema and check the schema on first use, then reuse the validator for warm requests
+def get_validator():
+    global _validator
+    if _validator is None:
+        from jsonschema.validators import validator_for
+        validator_class = validator_for(WIDGET_REQUEST_SCHEMA)
+        validator_class.check_schema(WIDGET_REQUEST_SCHEMA)
+        _validator = validator_class(WIDGET_REQUEST_SCHEMA)
+    return _validator
+
 def validate_widget_request(request_body):
-    try:
-        validate(instance=request_body, schema=WIDGET_REQUEST_SCHEMA)
-    except ValidationError as e:
+    from jsonschema.exceptions import best_match
+    e = best_match(get_validator().iter_errors(request_body))
+    if e is not None:
         logging.error(f"Validation failed: {e.message}")
         return {
             "statusCode": 400,
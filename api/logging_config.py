@@ -1,12 +1,18 @@
 import logging
 
+_configured = False
+
 def setup_logging():
+    # Only configure handlers once, no matter how many modules ask for logging
+    global _configured
+    if _configured:
+        return
     logging.basicConfig(
         level=logging.INFO,  # Set to DEBUG to capture all log levels
         format='%(asctime)s:%(levelname)s:%(message)s',  # Log format
         handlers=[
             logging.StreamHandler(),  # Output to console
-            logging.FileHandler("request_handler.log")  # Optionally log to a file
+            logging.FileHandler("request_handler.log", delay=True)  # Optionally log to a file, opened on first record
         ]
     )
-
+    _configured = True
@@ -1,24 +1,157 @@
 import boto3
 import botocore
+from botocore.config import Config
 import json
+import math
 import time
 import logging
+import signal
 import argparse
 # Configure logging
 logging.basicConfig(filename='consumer.log', level=logging.INFO, 
                     format='%(asctime)s:%(levelname)s:%(message)s')
 
+#error codes AWS returns when a write is rejected for exceeding capacity
+THROTTLING_ERROR_CODES = {
+    'ProvisionedThroughputExceededException',
+    'RequestLimitExceeded',
+    'ThrottlingException',
+    'Throttling',
+    'SlowDown',
+}
+
+#highest code point, so quarantine_prefix + this sorts after every quarantined key
+QUARANTINE_RANGE_END = '\U0010ffff'
+
+#one HTTP call per attempt: botocore's own retries would hide throttling from the limiters
+WRITE_CLIENT_CONFIG = Config(retries={'mode': 'standard', 'total_max_attempts': 1})
+
+class TokenBucket:
+    def __init__(self, rate=None, capacity=None, min_rate=1.0, base_backoff=0.1, max_backoff=5.0):
+        """
+        Token-bucket rate limiter that slows down when AWS reports throttling.
+        :param rate: Sustained rate in tokens per second, or None for no limit.
+        :param capacity: Largest burst allowed (defaults to one second of rate).
+        :param min_rate: Lowest rate the bucket will back off to.
+        :param base_backoff: First pause (seconds) after a throttled write.
+        :param max_backoff: Longest pause (seconds) after repeated throttling.
+        """
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.min_rate = min(min_rate, rate) if rate else min_rate
+        self.tokens = self.capacity or 0
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.backoff = 0
+        self.resume_at = 0
+        self.last_refill = time.monotonic()
+        self.last_adjusted = self.last_refill
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    #block until the requested tokens are available (or max_wait runs out), returns the seconds spent waiting
+    def acquire(self, tokens=1, max_wait=None):
+        self._refill()
+        wait = max(0.0, self.resume_at - time.monotonic())
+        if self.rate:
+            deficit = tokens - self.tokens
+            if deficit > 0:
+                wait = max(wait, deficit / self.rate)
+        if max_wait is not None:
+            wait = min(wait, max_wait)
+        if wait > 0:
+            time.sleep(wait)
+            self._refill()
+        if self.rate:
+            self.tokens -= tokens
+        return wait
+
+    #multiplicative decrease: halve the rate and pause writes with exponential backoff
+    def throttled(self):
+        self.backoff = min(self.max_backoff, self.backoff * 2 if self.backoff else self.base_backoff)
+        self.last_adjusted = time.monotonic()
+        self.resume_at = self.last_adjusted + self.backoff
+        if self.rate:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+
+    #additive increase: recover a tenth of the configured rate per second since the last adjustment
+    def succeeded(self):
+        self.backoff = 0
+        now = time.monotonic()
+        if self.rate and self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.1 * (now - self.last_adjusted))
+        self.last_adjusted = now
+
+    #how far the rate has been cut below the configured rate, from 0.0 (full speed) upwards
+    def pressure(self):
+        if not self.rate:
+            return 0.0
+        return 1.0 - self.rate / self.max_rate
+
+class ShutdownController:
+    def __init__(self, drain_timeout=25.0):
+        """
+        Track a shutdown request and the deadline for draining in-flight work.
+        :param drain_timeout: Seconds allowed to finish in-flight work once shutdown is requested.
+        """
+        self.drain_timeout = drain_timeout
+        self.requested_at = None
+
+    #stop on SIGTERM (container scale-in) and SIGINT (ctrl-c)
+    def install(self):
+        signal.signal(signal.SIGTERM, self.request_shutdown)
+        signal.signal(signal.SIGINT, self.request_shutdown)
+
+    def request_shutdown(self, signum=None, frame=None):
+        if signum is not None:
+            #a repeated signal gets the default action, so a stuck drain can still be interrupted
+            signal.signal(signum, signal.SIG_DFL)
+        if self.requested_at is None:
+            self.requested_at = time.monotonic()
+            logging.info(f"Shutdown requested (signal {signum}); draining in-flight work for up to {self.drain_timeout}s")
+
+    @property
+    def requested(self):
+        return self.requested_at is not None
+
+    #seconds left to drain, or None when no shutdown has been requested
+    def time_left(self):
+        if not self.requested:
+            return None
+        return max(0.0, self.drain_timeout - (time.monotonic() - self.requested_at))
+
+    def deadline_passed(self):
+        return self.requested and self.time_left() == 0
+
 class Consumer:
-    def __init__(self, queue_name=None, request_bucket=None, storage_bucket=None, table_name=None):
+    def __init__(self, queue_name=None, request_bucket=None, storage_bucket=None, table_name=None,
+                 dynamodb_wcu=None, s3_put_rate=None, max_write_attempts=5,
+                 dlq_name=None, quarantine_prefix='quarantine/', max_request_attempts=3, drain_timeout=25.0):
         """
         Initialize the Consumer with bucket names and table name.
         :param queue_name: Queue containing incoming messages/requests.
         :param request_bucket: Bucket containing incoming requests.
         :param storage_bucket: Bucket to store processed widgets (Bucket 3).
         :param table_name: DynamoDB table name.
+        :param dynamodb_wcu: DynamoDB write capacity units per second (None for no limit).
+        :param s3_put_rate: S3 PUT/DELETE requests per second (None for no limit).
+        :param max_write_attempts: Attempts per write before a throttling error is raised.
+        :param dlq_name: Queue that receives messages which keep failing (None to leave them on the queue).
+        :param quarantine_prefix: Request bucket prefix that receives requests which keep failing.
+        :param max_request_attempts: Attempts per request/message before it is quarantined.
+        :param drain_timeout: Seconds allowed to finish in-flight work after a shutdown signal.
         """
-        self.s3 = boto3.client('s3')
-        self.dynamodb = boto3.resource('dynamodb')
+        if not quarantine_prefix:
+            #an empty prefix would match every key and the consumer would never see a request
+            raise ValueError("quarantine_prefix must not be empty")
+        self.s3 = boto3.client('s3', config=WRITE_CLIENT_CONFIG)
+        self.dynamodb = boto3.resource('dynamodb', config=WRITE_CLIENT_CONFIG)
         self.sqs = boto3.client('sqs')
         
         self.queue_name = queue_name
@@ -28,48 +161,157 @@ class Consumer:
         self.table = self.dynamodb.Table(self.table_name)
         self.message_cache = []
         self.queue_url = None
+        self.dynamodb_limiter = TokenBucket(rate=dynamodb_wcu)
+        self.s3_limiter = TokenBucket(rate=s3_put_rate)
+        self.max_write_attempts = max_write_attempts
+        self.dlq_name = dlq_name
+        self.dlq_url = None
+        self.quarantine_prefix = quarantine_prefix
+        self.max_request_attempts = max_request_attempts
+        #failed attempts per request key and per message id, and keys we could not quarantine
+        self.failure_counts = {}
+        self.message_failure_counts = {}
+        self.skipped_keys = set()
+        self.shutdown = ShutdownController(drain_timeout)
         
-        #get queue url if queue_name is specified
+        #get queue urls if queue names are specified
         if self.queue_name:
-            try:
-                # Attempt to get the queue URL
-                response = self.sqs.get_queue_url(QueueName=self.queue_name)
-                self.queue_url = response['QueueUrl']
-                logging.info(f"Queue URL retrieved: {self.queue_url}")
-            except self.sqs.exceptions.QueueDoesNotExist:
-                logging.error(f"The queue '{self.queue_name}' does not exist.")
-            except Exception as e:
-                logging.error(f"Failed to retrieve queue URL: {e}")
+            self.queue_url = self.lookup_queue_url(self.queue_name)
+        if self.dlq_name:
+            self.dlq_url = self.lookup_queue_url(self.dlq_name)
         logging.info("Consumer initialized.")
 
+    def lookup_queue_url(self, queue_name):
+        try:
+            # Attempt to get the queue URL
+            response = self.sqs.get_queue_url(QueueName=queue_name)
+            queue_url = response['QueueUrl']
+            logging.info(f"Queue URL retrieved: {queue_url}")
+            return queue_url
+        except self.sqs.exceptions.QueueDoesNotExist:
+            logging.error(f"The queue '{queue_name}' does not exist.")
+        except Exception as e:
+            logging.error(f"Failed to retrieve queue URL: {e}")
+        return None
+
     def poll_requests(self):
         empty_poll_count = 0
         max_empty_polls = 10
         
         #process and delete requests once they've been processed
-        while empty_poll_count < max_empty_polls:
+        #writes block on their limiter, so a throttled write also holds back the next fetch
+        while empty_poll_count < max_empty_polls and not self.shutdown.requested:
             request_key = self.get_next_request()
             if request_key:
-                self.process_request(request_key)
-                self.s3.delete_object(Bucket=self.request_bucket, Key=request_key)
-                logging.info(f"Processed and deleted request: {request_key}")
                 empty_poll_count = 0
+                try:
+                    self.process_request(request_key)
+                    self.s3_write(self.s3.delete_object, Bucket=self.request_bucket, Key=request_key)
+                except Exception as e:
+                    self.record_request_failure(request_key, e)
+                    continue
+                self.failure_counts.pop(request_key, None)
+                logging.info(f"Processed and deleted request: {request_key}")
             else:
                 empty_poll_count += 1
                 time.sleep(0.1)
+        if self.shutdown.requested:
+            logging.info("Shutdown complete. Exiting.")
+            print('shutdown complete. exiting')
+            return
         logging.info("No more requests found. Exiting.")
         print('no more requests found. exiting')
-    #get next request in the s3 bucket
+
+    #process messages from SQS, deleting each one once it has been processed
+    def poll_queue(self):
+        empty_poll_count = 0
+        max_empty_polls = 10
+
+        while empty_poll_count < max_empty_polls and not self.shutdown.requested:
+            message = self.get_next_message()
+            if message:
+                self.process_message(message)
+                empty_poll_count = 0
+            else:
+                empty_poll_count += 1
+        #hand back anything we prefetched but never started
+        self.release_cached_messages()
+        if self.shutdown.requested:
+            logging.info("Shutdown complete. Exiting.")
+            print('shutdown complete. exiting')
+            return
+        logging.info("No more messages found. Exiting.")
+        print('no more messages found. exiting')
+
+    #get next request in the s3 bucket, skipping quarantined objects
+    #S3 lists keys in ascending order, so scan up to the quarantine prefix and then
+    #jump past the whole quarantine range with StartAfter instead of listing it
     def get_next_request(self):
-        response = self.s3.list_objects_v2(Bucket=self.request_bucket)
-        if 'Contents' in response:
-            sorted_objects = sorted(response['Contents'], key=lambda x: x['Key'])
-            return sorted_objects[0]['Key'] if sorted_objects else None
+        for key in self.list_request_keys():
+            if key.startswith(self.quarantine_prefix):
+                break
+            if key not in self.skipped_keys:
+                return key
+        else:
+            return None
+        for key in self.list_request_keys(start_after=self.quarantine_prefix + QUARANTINE_RANGE_END):
+            if key.startswith(self.quarantine_prefix) or key in self.skipped_keys:
+                continue
+            return key
         return None
+
+    #yield request bucket keys in order, a small page at a time since we usually want the first one
+    def list_request_keys(self, start_after=None):
+        kwargs = {'Bucket': self.request_bucket, 'MaxKeys': 10}
+        if start_after:
+            kwargs['StartAfter'] = start_after
+        while True:
+            response = self.s3.list_objects_v2(**kwargs)
+            for obj in response.get('Contents', []):
+                yield obj['Key']
+            if not response.get('IsTruncated'):
+                return
+            kwargs['ContinuationToken'] = response['NextContinuationToken']
     #logic for processing requests
     def process_request(self, key):
         obj = self.s3.get_object(Bucket=self.request_bucket, Key=key)
         request = json.loads(obj['Body'].read().decode('utf-8'))
+        self.handle_request(request)
+
+    def process_message(self, message):
+        """
+        Process a single SQS message, isolating any failure to that message.
+        :param message: Message as returned by receive_message.
+        :return: True if the message was processed and deleted.
+        """
+        try:
+            request = json.loads(message['Body'])
+            self.handle_request(request)
+        except Exception as e:
+            if self.is_throttling_error(e):
+                #throttling says nothing about the message, retry it once the limiters have backed off
+                backoff = max(self.dynamodb_limiter.backoff, self.s3_limiter.backoff)
+                if self.shutdown.requested:
+                    #abandoned at the drain deadline, hand it straight back like the prefetched messages
+                    backoff = 0
+                logging.warning(f"Message {message.get('MessageId')} throttled, retrying in {backoff:.2f}s: {e}")
+                self.change_message_visibility(message, math.ceil(backoff))
+                return False
+            #a failed message stays on the queue and is redelivered after its visibility timeout.
+            #count real failures ourselves: ApproximateReceiveCount also grows on throttle and shutdown requeues
+            message_id = message.get('MessageId')
+            attempts = self.message_failure_counts.get(message_id, 0) + 1
+            self.message_failure_counts[message_id] = attempts
+            logging.error(f"Failed to process message {message_id} (attempt {attempts}): {e}")
+            if attempts >= self.max_request_attempts:
+                self.message_failure_counts.pop(message_id, None)
+                self.quarantine_message(message, e, attempts)
+            return False
+        self.message_failure_counts.pop(message.get('MessageId'), None)
+        self.delete_message_from_queue(message['ReceiptHandle'])
+        return True
+
+    def handle_request(self, request):
         logging.info(f"Processing request: {request}")
 
         request_type = request.get("type")
@@ -90,6 +332,8 @@ class Consumer:
 
     #if the request is a create request, create the item in s3 and dynamodb
     def handle_create_request(self, request):
+        if not request.get('owner'):
+            raise ValueError("Create request missing owner")
         widget = {
             'id': request.get('widgetId'),  # Map widgetId to id for DynamoDB
             'requestId': request.get('requestId'),
@@ -121,23 +365,27 @@ class Consumer:
         try:
             # Retrieve current widget from DynamoDB
             response = self.table.get_item(Key={'id': widget_id})
-            if 'Item' not in response:
-                logging.error(f"Widget with id {widget_id} not found for update")
-                return
-            updated_widget = response['Item']
-            
-            #only update the attributes present in request
-            for key, value in updates.items():
-                updated_widget[key] = value
-
-            # Save updated widget back to DynamoDB
-            self.table.put_item(Item=updated_widget)
-            
-            # Save updated widget back to S3
-            self.s3.put_object(Bucket=self.storage_bucket, Key="widgets/test-user/1", Body=json.dumps(updated_widget))
-        
         except botocore.exceptions.ClientError as e:
+            if self.is_throttling_error(e):
+                #without client retries a throttled read must reach the poll loop to be retried
+                raise
             logging.error(f"error retrieving widget with id {widget_id}: {e}")
+            return
+        if 'Item' not in response:
+            logging.error(f"Widget with id {widget_id} not found for update")
+            return
+        updated_widget = response['Item']
+        
+        #only update the attributes present in request
+        for key, value in updates.items():
+            updated_widget[key] = value
+
+        #write errors propagate so the poll loop can retry or quarantine the request
+        # Save updated widget back to DynamoDB
+        self.dynamodb_write(self.table.put_item, Item=updated_widget)
+        
+        # Save updated widget back to S3
+        self.s3_write(self.s3.put_object, Bucket=self.storage_bucket, Key="widgets/test-user/1", Body=json.dumps(updated_widget))
     
     #delete widget from both dynamodb and s3
     def handle_delete_request(self, request):
@@ -147,12 +395,12 @@ class Consumer:
             return
 
         # Delete widget from DynamoDB
-        self.table.delete_item(Key={'id': widget_id})
+        self.dynamodb_write(self.table.delete_item, Key={'id': widget_id})
 
         # Optionally, delete related S3 object
         owner = request.get('owner', '').replace(" ", "-").lower()
         s3_key = f"widgets/{owner}/{widget_id}"
-        self.s3.delete_object(Bucket=self.request_bucket, Key=s3_key)
+        self.s3_write(self.s3.delete_object, Bucket=self.request_bucket, Key=s3_key)
         
     def store_in_s3(self, widget):
         flattened_widget = {
@@ -173,7 +421,7 @@ class Consumer:
     
         owner = widget['owner'].replace(" ", "-").lower()
         key = f"widgets/{owner}/{widget['widgetId']}"
-        self.s3.put_object(Bucket=self.storage_bucket, Key=key, Body=json.dumps(flattened_widget))
+        self.s3_write(self.s3.put_object, Bucket=self.storage_bucket, Key=key, Body=json.dumps(flattened_widget))
         logging.info(f"Stored widget in S3 at key: {key}")
         print(f"stored widgeet in s3 at key: {key}")
         
@@ -200,9 +448,109 @@ class Consumer:
                 if name and value is not None:
                     flattened_widget[name] = value
           
-        self.table.put_item(Item=flattened_widget)
+        self.dynamodb_write(self.table.put_item, Item=flattened_widget)
         logging.info(f"Stored widget in DynamoDB: {flattened_widget['widgetId']}")
         print(f"Stored widget in DynamoDB: {flattened_widget['widgetId']}")
+
+    #run a write through a limiter, backing off and retrying when AWS throttles it
+    def throttled_write(self, limiter, write, tokens=1, **kwargs):
+        for attempt in range(1, self.max_write_attempts + 1):
+            limiter.acquire(tokens, max_wait=self.shutdown.time_left())
+            try:
+                response = write(**kwargs)
+            except botocore.exceptions.ClientError as e:
+                error_code = e.response.get('Error', {}).get('Code')
+                if error_code not in THROTTLING_ERROR_CODES:
+                    raise
+                limiter.throttled()
+                if attempt == self.max_write_attempts:
+                    raise
+                if self.shutdown.deadline_passed():
+                    logging.error(f"Write throttled ({error_code}) after the shutdown drain deadline; giving up")
+                    raise
+                logging.warning(f"Write throttled ({error_code}), attempt {attempt}; backing off {limiter.backoff:.2f}s")
+                continue
+            limiter.succeeded()
+            return response
+
+    #dynamodb writes consume one WCU per started KB of item data
+    def dynamodb_write(self, write, **kwargs):
+        item = kwargs.get('Item', kwargs.get('Key', {}))
+        wcu = max(1, math.ceil(len(json.dumps(item, default=str)) / 1024))
+        return self.throttled_write(self.dynamodb_limiter, write, tokens=wcu, **kwargs)
+
+    def s3_write(self, write, **kwargs):
+        return self.throttled_write(self.s3_limiter, write, **kwargs)
+
+    def is_throttling_error(self, error):
+        return isinstance(error, botocore.exceptions.ClientError) and \
+            error.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+    #count a failed attempt and quarantine the request once it runs out of attempts
+    def record_request_failure(self, key, error):
+        if self.is_throttling_error(error):
+            #throttling says nothing about the request itself, the limiter has already backed off
+            logging.warning(f"Request {key} throttled, will retry: {error}")
+            return
+        attempts = self.failure_counts.get(key, 0) + 1
+        self.failure_counts[key] = attempts
+        logging.error(f"Failed to process request {key} (attempt {attempts}): {error}")
+        if attempts >= self.max_request_attempts:
+            self.failure_counts.pop(key, None)
+            self.quarantine_request(key, error, attempts)
+        else:
+            time.sleep(0.1)
+
+    #error details in a form S3 metadata and SQS message attributes accept
+    def describe_error(self, error, attempts):
+        message = ' '.join(str(error).split()).encode('ascii', 'replace').decode('ascii')
+        #SQS rejects empty attribute values, so fall back to the type for errors without text
+        message = message or type(error).__name__
+        return {
+            'error-type': type(error).__name__,
+            'error-message': message[:1024],
+            'attempts': str(attempts),
+            'quarantined-at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        }
+
+    #move a poison request under the quarantine prefix with the error as object metadata
+    def quarantine_request(self, key, error, attempts):
+        quarantine_key = f"{self.quarantine_prefix}{key}"
+        try:
+            self.s3_write(self.s3.copy_object, Bucket=self.request_bucket, Key=quarantine_key,
+                          CopySource={'Bucket': self.request_bucket, 'Key': key},
+                          Metadata=self.describe_error(error, attempts), MetadataDirective='REPLACE')
+            self.s3_write(self.s3.delete_object, Bucket=self.request_bucket, Key=key)
+        except Exception as e:
+            #never let a request we can't move block the rest of the bucket
+            logging.error(f"Failed to quarantine request {key}, skipping it: {e}")
+            self.skipped_keys.add(key)
+            return
+        logging.warning(f"Quarantined request {key} at {quarantine_key} after {attempts} attempts")
+        print(f"quarantined request {key} after {attempts} attempts")
+
+    #send a poison message to the dead-letter queue with the error as message attributes
+    def quarantine_message(self, message, error, attempts):
+        if not self.dlq_url:
+            logging.error(f"No dead-letter queue configured; leaving message {message.get('MessageId')} on the queue")
+            return
+        attributes = {
+            name: {'DataType': 'Number' if name == 'attempts' else 'String', 'StringValue': value}
+            for name, value in self.describe_error(error, attempts).items()
+        }
+        try:
+            self.sqs.send_message(QueueUrl=self.dlq_url, MessageBody=message['Body'], MessageAttributes=attributes)
+            self.delete_message_from_queue(message['ReceiptHandle'])
+        except Exception as e:
+            #never let a message we can't move stop the rest of the queue
+            logging.error(f"Failed to move message {message.get('MessageId')} to dead-letter queue: {e}")
+            return
+        logging.warning(f"Moved message {message.get('MessageId')} to dead-letter queue after {attempts} attempts")
+
+    #shrink the fetch batch in proportion to how far throttling has cut the write rate
+    def fetch_batch_size(self, max_messages=10):
+        pressure = max(self.dynamodb_limiter.pressure(), self.s3_limiter.pressure())
+        return max(1, round(max_messages * (1 - pressure)))
     
     #get messages from SQS
     def get_messages_from_queue(self, max_messages=10):
@@ -212,7 +560,8 @@ class Consumer:
         response = self.sqs.receive_message(
             QueueUrl=self.queue_url,
             MaxNumberOfMessages=max_messages,
-            WaitTimeSeconds=10  # Long polling to reduce empty responses
+            # Long polling to reduce empty responses, kept well inside the shutdown drain timeout
+            WaitTimeSeconds=min(10, int(self.shutdown.drain_timeout / 2))
         )
         logging.info("recieved messages: ", response)
         return response.get('Messages', [])
@@ -223,16 +572,50 @@ class Consumer:
             QueueUrl=self.queue_url,
             ReceiptHandle=receipt_handle
         )
+
+    #put a message back on the queue after visibility_timeout seconds
+    def change_message_visibility(self, message, visibility_timeout):
+        try:
+            self.sqs.change_message_visibility(
+                QueueUrl=self.queue_url,
+                ReceiptHandle=message['ReceiptHandle'],
+                VisibilityTimeout=visibility_timeout
+            )
+        except Exception as e:
+            logging.error(f"Failed to change visibility of message {message.get('MessageId')}: {e}")
         
     #retrieve the next queue message from the cache if we have one, otherwise retrieve from AWS SQS
     def get_next_message(self):
-        if not self.message_cache:
-            self.message_cache = self.get_messages_from_queue(max_messages=10)
+        if not self.message_cache and not self.shutdown.requested:
+            self.message_cache = self.get_messages_from_queue(max_messages=self.fetch_batch_size(10))
+            if self.shutdown.requested:
+                #shutdown arrived during the long poll, leave the whole batch for poll_queue to release
+                return None
 
         if self.message_cache:
             return self.message_cache.pop(0)  # Return and remove the next message
         return None
 
+    #make prefetched messages visible again right away instead of waiting out their visibility timeout
+    def release_cached_messages(self):
+        released = 0
+        while self.message_cache:
+            batch, self.message_cache = self.message_cache[:10], self.message_cache[10:]
+            entries = [
+                {'Id': str(i), 'ReceiptHandle': message['ReceiptHandle'], 'VisibilityTimeout': 0}
+                for i, message in enumerate(batch)
+            ]
+            try:
+                response = self.sqs.change_message_visibility_batch(QueueUrl=self.queue_url, Entries=entries)
+            except Exception as e:
+                logging.error(f"Failed to release {len(entries)} prefetched messages: {e}")
+                continue
+            for failure in response.get('Failed', []):
+                logging.error(f"Failed to release prefetched message {failure.get('Id')}: {failure.get('Message')}")
+            released += len(response.get('Successful', []))
+        if released:
+            logging.info(f"Released {released} prefetched messages back to the queue")
+
 if __name__ == "__main__":
     # Parse command-line arguments
     parser = argparse.ArgumentParser(description="Run the S3-DynamoDB consumer.")
@@ -240,13 +623,30 @@ if __name__ == "__main__":
     parser.add_argument('--request-bucket', required=False, help="request bucket name")
     parser.add_argument('--storage-bucket', required=False, help="storage bucket name")
     parser.add_argument('--table-name', required=False, help="DynamoDB table name")
-    parser.add_argument('--strategy', choices=['polling', 'event-driven'], default='polling',
+    parser.add_argument('--strategy', choices=['polling', 'queue', 'event-driven'], default='polling',
                         help="Storage strategy to use (default: polling)")
+    parser.add_argument('--dynamodb-wcu', type=float, required=False,
+                        help="DynamoDB write capacity units per second (default: unlimited)")
+    parser.add_argument('--s3-put-rate', type=float, required=False,
+                        help="S3 PUT/DELETE requests per second (default: unlimited)")
+    parser.add_argument('--dlq-name', required=False, help="dead-letter queue for messages that keep failing")
+    parser.add_argument('--quarantine-prefix', default='quarantine/',
+                        help="request bucket prefix for requests that keep failing (default: quarantine/)")
+    parser.add_argument('--max-request-attempts', type=int, default=3,
+                        help="attempts per request before it is quarantined (default: 3)")
+    parser.add_argument('--drain-timeout', type=float, default=25.0,
+                        help="seconds to finish in-flight work after SIGTERM (default: 25)")
 
     args = parser.parse_args()
     # Instantiate and start the consumer
-    consumer = Consumer(queue_name=args.queue_name, request_bucket=args.request_bucket, storage_bucket=args.storage_bucket, table_name=args.table_name)
+    consumer = Consumer(queue_name=args.queue_name, request_bucket=args.request_bucket, storage_bucket=args.storage_bucket, table_name=args.table_name,
+                        dynamodb_wcu=args.dynamodb_wcu, s3_put_rate=args.s3_put_rate,
+                        dlq_name=args.dlq_name, quarantine_prefix=args.quarantine_prefix,
+                        max_request_attempts=args.max_request_attempts, drain_timeout=args.drain_timeout)
+    consumer.shutdown.install()
     if args.strategy == 'polling':
         consumer.poll_requests()
+    elif args.strategy == 'queue':
+        consumer.poll_queue()
     else:
         logging.info("Event-driven strategy is not implemented yet.")
\ No newline at end of file
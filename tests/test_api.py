@@ -1,9 +1,17 @@
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
 from unittest.mock import patch
 from moto import mock_aws
 import boto3
 import json
 from api.request_handler import request_handler
+import api.logging_config
+from api.logging_config import setup_logging
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 class TestRequestHandler(unittest.TestCase):
     def setUp(self):
@@ -128,5 +136,53 @@ class TestRequestHandler(unittest.TestCase):
         self.assertEqual(body["error"], "Failed to send message to queue.")
 
 
+class TestColdStart(unittest.TestCase):
+    # Budget for importing the handler in a fresh interpreter, in microseconds
+    IMPORT_BUDGET_US = 100000
+    HEAVY_MODULES = {"boto3", "botocore", "jsonschema"}
+
+    def import_profile(self):
+        # Equivalent of `python -X importtime -c "import api.request_handler"`
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import api.request_handler"],
+            cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        )
+        profile = {}
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            _, self_us, cumulative_us, name = [part.strip() for part in line.replace("import time:", "|").split("|")]
+            profile[name] = (int(self_us), int(cumulative_us))
+        return profile, result.stderr
+
+    def test_import_defers_heavy_dependencies(self):
+        profile, report = self.import_profile()
+        self.assertIn("api.request_handler", profile, report)
+        self.assertFalse(self.HEAVY_MODULES & set(profile), report)
+
+    def test_import_time_within_budget(self):
+        profile, report = self.import_profile()
+        cumulative_us = profile["api.request_handler"][1]
+        self.assertLess(cumulative_us, self.IMPORT_BUDGET_US,
+                        f"api.request_handler took {cumulative_us}us to import:\n{report}")
+
+    def test_setup_logging_configures_once(self):
+        # Each call used to build (and open) a new FileHandler even when basicConfig ignored it
+        with patch.object(api.logging_config, "_configured", False), \
+                patch("api.logging_config.logging.FileHandler") as mock_file_handler:
+            setup_logging()
+            setup_logging()
+            setup_logging()
+        mock_file_handler.assert_called_once_with("request_handler.log", delay=True)
+
+    def test_import_does_not_create_log_file(self):
+        with tempfile.TemporaryDirectory() as cwd:
+            subprocess.run(
+                [sys.executable, "-c", "import api.request_handler"],
+                cwd=cwd, env={**os.environ, "PYTHONPATH": REPO_ROOT}, check=True
+            )
+            self.assertFalse(os.path.exists(os.path.join(cwd, "request_handler.log")))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,10 +1,26 @@
+import os
+import signal
 import sys
 import unittest
+from unittest.mock import patch
 from moto import mock_aws
 import boto3
+import botocore
+from botocore.awsrequest import AWSResponse
 import json
 import time
-from consumer.consumer import Consumer
+from consumer.consumer import Consumer, ShutdownController, TokenBucket
+
+def throttling_error(code, operation_name):
+    return botocore.exceptions.ClientError({'Error': {'Code': code, 'Message': 'throttled'}}, operation_name)
+
+class RawBody:
+    # Minimal stand-in for the raw HTTP body botocore reads a response from
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
 
 class TestConsumer(unittest.TestCase):
     def setUp(self):
@@ -57,6 +73,10 @@ class TestConsumer(unittest.TestCase):
             table_name=self.table_name
         )
 
+
+    def tearDown(self):
+        # Stop Moto mocks
+        self.mock_aws.stop()
     
     def test_get_next_request(self):
         # Add a request object to S3
@@ -209,6 +229,341 @@ class TestConsumer(unittest.TestCase):
         # Verify the S3 object is deleted
         with self.assertRaises(self.s3.exceptions.NoSuchKey):
             self.s3.get_object(Bucket=self.storage_bucket, Key='widgets/test-user/1')
+
+    @patch("consumer.consumer.time.sleep")
+    def test_store_in_dynamodb_retries_when_throttled(self, mock_sleep):
+        throttled = throttling_error('ProvisionedThroughputExceededException', 'PutItem')
+        widget = {'requestId': '1', 'widgetId': '1', 'owner': 'Test User'}
+
+        with patch.object(self.consumer.table, 'put_item', side_effect=[throttled, {}]) as mock_put:
+            self.consumer.store_in_dynamodb(widget)
+
+        self.assertEqual(mock_put.call_count, 2)
+        self.assertTrue(mock_sleep.called)
+
+    @patch("consumer.consumer.time.sleep")
+    def test_throttled_write_raises_after_max_attempts(self, mock_sleep):
+        self.consumer.max_write_attempts = 3
+        throttled = throttling_error('SlowDown', 'PutObject')
+
+        with patch.object(self.consumer.s3, 'put_object', side_effect=throttled) as mock_put, \
+                patch.object(self.consumer.s3_limiter, 'throttled', wraps=self.consumer.s3_limiter.throttled) as mock_throttled:
+            with self.assertRaises(botocore.exceptions.ClientError):
+                self.consumer.store_in_s3({'requestId': '1', 'widgetId': '1', 'owner': 'Test User'})
+
+        self.assertEqual(mock_put.call_count, 3)
+        # The final throttled attempt is recorded too
+        self.assertEqual(mock_throttled.call_count, 3)
+
+    @patch("consumer.consumer.time.sleep")
+    def test_handle_update_request_raises_when_throttled(self, mock_sleep):
+        self.table.put_item(Item={'id': '1', 'requestId': '1', 'widgetId': '1', 'owner': 'Test User', 'label': 'Old Label'})
+        throttled = throttling_error('ProvisionedThroughputExceededException', 'PutItem')
+
+        with patch.object(self.consumer.table, 'put_item', side_effect=throttled):
+            with self.assertRaises(botocore.exceptions.ClientError):
+                self.consumer.handle_update_request({'type': 'update', 'requestId': '1', 'widgetId': '1', 'label': 'New Label'})
+
+    @patch("consumer.consumer.time.sleep")
+    def test_poll_requests_retries_throttled_update(self, mock_sleep):
+        self.table.put_item(Item={'id': '1', 'requestId': '1', 'widgetId': '1', 'owner': 'Test User', 'label': 'Old Label'})
+        self.s3.put_object(Bucket=self.request_bucket, Key='request1', Body=json.dumps({'type': 'update', 'requestId': '1', 'widgetId': '1', 'label': 'New Label'}))
+        throttled = throttling_error('ProvisionedThroughputExceededException', 'PutItem')
+        put_item = self.consumer.table.put_item
+        calls = []
+
+        # Throttle every attempt of the first poll, then let writes through
+        def flaky_put_item(**kwargs):
+            calls.append(kwargs)
+            if len(calls) <= self.consumer.max_write_attempts:
+                raise throttled
+            return put_item(**kwargs)
+
+        with patch.object(self.consumer.table, 'put_item', side_effect=flaky_put_item):
+            self.consumer.poll_requests()
+
+        # The update is retried instead of being dropped with the request
+        self.assertEqual(self.table.get_item(Key={'id': '1'})['Item']['label'], 'New Label')
+        self.assertNotIn('Contents', self.s3.list_objects_v2(Bucket=self.request_bucket))
+
+    @patch("consumer.consumer.time.sleep")
+    def test_process_message_does_not_dead_letter_throttled_message(self, mock_sleep):
+        dlq_url = self.sqs.create_queue(QueueName='message-dlq')['QueueUrl']
+        self.consumer.dlq_url = dlq_url
+        self.sqs.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps({'type': 'create', 'requestId': '1', 'widgetId': '1', 'owner': 'Test User'}))
+        throttled = throttling_error('ProvisionedThroughputExceededException', 'PutItem')
+
+        with patch.object(self.consumer.table, 'put_item', side_effect=throttled):
+            for _ in range(self.consumer.max_request_attempts):
+                message = self.consumer.get_messages_from_queue(max_messages=1)[0]
+                with patch.object(self.consumer.sqs, 'change_message_visibility', wraps=self.consumer.sqs.change_message_visibility) as mock_visibility:
+                    self.assertFalse(self.consumer.process_message(message))
+                # The message is pushed back by the limiter backoff rather than its full visibility timeout
+                visibility_timeout = mock_visibility.call_args.kwargs['VisibilityTimeout']
+                self.assertTrue(1 <= visibility_timeout <= self.consumer.dynamodb_limiter.max_backoff)
+                self.sqs.change_message_visibility(QueueUrl=self.queue_url, ReceiptHandle=message['ReceiptHandle'], VisibilityTimeout=0)
+
+        self.assertNotIn('Messages', self.sqs.receive_message(QueueUrl=dlq_url))
+        self.assertIn('Messages', self.sqs.receive_message(QueueUrl=self.queue_url))
+
+    def test_requeued_message_not_dead_lettered_on_first_failure(self):
+        dlq_url = self.sqs.create_queue(QueueName='message-dlq')['QueueUrl']
+        self.consumer.dlq_url = dlq_url
+        self.sqs.send_message(QueueUrl=self.queue_url, MessageBody='not json')
+
+        # Released twice without being processed, e.g. by throttling or a scale-in
+        for _ in range(2):
+            self.consumer.message_cache = self.consumer.get_messages_from_queue(max_messages=1)
+            self.consumer.release_cached_messages()
+
+        message = self.consumer.get_messages_from_queue(max_messages=1)[0]
+        self.assertFalse(self.consumer.process_message(message))
+
+        self.assertNotIn('Messages', self.sqs.receive_message(QueueUrl=dlq_url))
+
+    def test_quarantine_message_survives_missing_dlq(self):
+        self.consumer.dlq_url = self.sqs.create_queue(QueueName='message-dlq')['QueueUrl']
+        self.sqs.delete_queue(QueueUrl=self.consumer.dlq_url)
+        self.sqs.send_message(QueueUrl=self.queue_url, MessageBody='not json')
+        message = self.consumer.get_messages_from_queue(max_messages=1)[0]
+
+        # Logged rather than raised, so poll_queue keeps going
+        self.consumer.quarantine_message(message, ValueError('bad'), 3)
+
+    def test_quarantine_message_with_empty_error_text(self):
+        dlq_url = self.sqs.create_queue(QueueName='message-dlq')['QueueUrl']
+        self.consumer.dlq_url = dlq_url
+        self.sqs.send_message(QueueUrl=self.queue_url, MessageBody='not json')
+        message = self.consumer.get_messages_from_queue(max_messages=1)[0]
+
+        self.consumer.quarantine_message(message, Exception(), 3)
+
+        dead_letters = self.sqs.receive_message(QueueUrl=dlq_url, MessageAttributeNames=['All'])['Messages']
+        self.assertEqual(dead_letters[0]['MessageAttributes']['error-message']['StringValue'], 'Exception')
+
+    @patch("consumer.consumer.time.sleep")
+    def test_throttled_write_sends_one_call_per_attempt(self, mock_sleep):
+        sends = []
+
+        # Answer every PutItem on the wire with a throttling error
+        def throttle_put_item(request, **kwargs):
+            sends.append(request)
+            body = b'{"__type": "com.amazonaws.dynamodb.v20120810#ProvisionedThroughputExceededException", "message": "throttled"}'
+            return AWSResponse(request.url, 400, {}, RawBody(body))
+
+        client = self.consumer.table.meta.client
+        client.meta.events.register_first('before-send.dynamodb.PutItem', throttle_put_item)
+        try:
+            with self.assertRaises(botocore.exceptions.ClientError):
+                self.consumer.store_in_dynamodb({'requestId': '1', 'widgetId': '1', 'owner': 'Test User'})
+        finally:
+            client.meta.events.unregister('before-send.dynamodb.PutItem', throttle_put_item)
+
+        # botocore does not retry underneath the limiter
+        self.assertEqual(len(sends), self.consumer.max_write_attempts)
+
+    def test_fetch_batch_size_shrinks_when_throttled(self):
+        self.consumer.dynamodb_limiter = TokenBucket(rate=10)
+        self.assertEqual(self.consumer.fetch_batch_size(10), 10)
+
+        self.consumer.dynamodb_limiter.throttled()
+        self.assertEqual(self.consumer.fetch_batch_size(10), 5)
+
+    @patch("consumer.consumer.time.sleep")
+    def test_poll_requests_quarantines_poison_request(self, mock_sleep):
+        self.s3.put_object(Bucket=self.request_bucket, Key='request1', Body='not json')
+        self.s3.put_object(Bucket=self.request_bucket, Key='request2', Body=json.dumps({'type': 'create', 'requestId': '2', 'widgetId': '2'}))
+        self.s3.put_object(Bucket=self.request_bucket, Key='request3', Body=json.dumps({'type': 'create', 'requestId': '3', 'widgetId': '3', 'owner': 'Test User'}))
+
+        self.consumer.poll_requests()
+
+        # Both poison requests are moved under the quarantine prefix with error metadata
+        remaining = self.s3.list_objects_v2(Bucket=self.request_bucket)['Contents']
+        self.assertEqual(sorted(obj['Key'] for obj in remaining), ['quarantine/request1', 'quarantine/request2'])
+        quarantined = self.s3.head_object(Bucket=self.request_bucket, Key='quarantine/request2')
+        self.assertEqual(quarantined['Metadata']['error-type'], 'ValueError')
+        self.assertEqual(quarantined['Metadata']['attempts'], '3')
+
+        # The good request behind them is still processed
+        response = self.table.get_item(Key={'id': '3'})
+        self.assertIn('Item', response)
+
+    def test_get_next_request_skips_quarantine_range(self):
+        for i in range(25):
+            self.s3.put_object(Bucket=self.request_bucket, Key=f'quarantine/request{i:02}', Body='not json')
+        self.s3.put_object(Bucket=self.request_bucket, Key='a-request', Body='{}')
+        self.s3.put_object(Bucket=self.request_bucket, Key='request1', Body='{}')
+
+        self.assertEqual(self.consumer.get_next_request(), 'a-request')
+        self.s3.delete_object(Bucket=self.request_bucket, Key='a-request')
+
+        # Keys after the quarantine range are found without paging through it
+        with patch.object(self.consumer.s3, 'list_objects_v2', wraps=self.consumer.s3.list_objects_v2) as mock_list:
+            self.assertEqual(self.consumer.get_next_request(), 'request1')
+        self.assertEqual(mock_list.call_count, 2)
+        self.assertIn('StartAfter', mock_list.call_args.kwargs)
+
+    def test_empty_quarantine_prefix_rejected(self):
+        with self.assertRaises(ValueError):
+            Consumer(queue_name=self.queue_name, request_bucket=self.request_bucket,
+                     storage_bucket=self.storage_bucket, table_name=self.table_name, quarantine_prefix='')
+
+    def test_process_message_moves_poison_message_to_dlq(self):
+        dlq_url = self.sqs.create_queue(QueueName='message-dlq')['QueueUrl']
+        self.consumer.dlq_url = dlq_url
+        self.sqs.send_message(QueueUrl=self.queue_url, MessageBody='not json')
+
+        for attempt in range(1, self.consumer.max_request_attempts + 1):
+            message = self.consumer.get_messages_from_queue(max_messages=1)[0]
+            self.assertFalse(self.consumer.process_message(message))
+            if attempt < self.consumer.max_request_attempts:
+                # Make the failed message visible again instead of waiting out its timeout
+                self.sqs.change_message_visibility(QueueUrl=self.queue_url, ReceiptHandle=message['ReceiptHandle'], VisibilityTimeout=0)
+
+        dead_letters = self.sqs.receive_message(QueueUrl=dlq_url, MessageAttributeNames=['All'])['Messages']
+        self.assertEqual(dead_letters[0]['Body'], 'not json')
+        self.assertEqual(dead_letters[0]['MessageAttributes']['error-type']['StringValue'], 'JSONDecodeError')
+        self.assertNotIn('Messages', self.sqs.receive_message(QueueUrl=self.queue_url))
+
+    def test_poll_requests_stops_fetching_after_shutdown(self):
+        self.s3.put_object(Bucket=self.request_bucket, Key='request1', Body=json.dumps({'type': 'create', 'requestId': '1', 'widgetId': '1', 'owner': 'Test User'}))
+        self.consumer.shutdown.request_shutdown()
+
+        self.consumer.poll_requests()
+
+        # The request is left for another consumer
+        self.s3.head_object(Bucket=self.request_bucket, Key='request1')
+
+    def test_poll_queue_drains_in_flight_and_releases_prefetched(self):
+        for i in range(3):
+            self.sqs.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps({'type': 'create', 'requestId': str(i), 'widgetId': str(i), 'owner': 'Test User'}))
+        self.consumer.message_cache = self.consumer.get_messages_from_queue(max_messages=10)
+        self.assertEqual(len(self.consumer.message_cache), 3)
+
+        # Shutdown arrives while the first message is being processed
+        with patch.object(self.consumer, 'handle_request', side_effect=lambda request: self.consumer.shutdown.request_shutdown()):
+            self.consumer.poll_queue()
+
+        self.assertEqual(self.consumer.message_cache, [])
+        # The in-flight message was acknowledged, the other two are visible again immediately
+        released = self.sqs.receive_message(QueueUrl=self.queue_url, MaxNumberOfMessages=10, VisibilityTimeout=0)['Messages']
+        self.assertEqual(len(released), 2)
+
+    def test_poll_queue_releases_batch_received_during_shutdown(self):
+        for i in range(2):
+            self.sqs.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps({'type': 'create', 'requestId': str(i), 'widgetId': str(i), 'owner': 'Test User'}))
+        get_messages_from_queue = self.consumer.get_messages_from_queue
+
+        # SIGTERM lands while receive_message is long polling
+        def receive_then_shutdown(max_messages=10):
+            messages = get_messages_from_queue(max_messages)
+            self.consumer.shutdown.request_shutdown()
+            return messages
+
+        with patch.object(self.consumer, 'get_messages_from_queue', side_effect=receive_then_shutdown), \
+                patch.object(self.consumer, 'handle_request') as mock_handle:
+            self.consumer.poll_queue()
+
+        mock_handle.assert_not_called()
+        released = self.sqs.receive_message(QueueUrl=self.queue_url, MaxNumberOfMessages=10)['Messages']
+        self.assertEqual(len(released), 2)
+
+    @patch("consumer.consumer.time.sleep")
+    def test_throttled_write_gives_up_after_drain_deadline(self, mock_sleep):
+        self.consumer.shutdown = ShutdownController(drain_timeout=0)
+        self.consumer.shutdown.request_shutdown()
+        throttled = throttling_error('SlowDown', 'PutObject')
+
+        with patch.object(self.consumer.s3, 'put_object', side_effect=throttled) as mock_put:
+            with self.assertRaises(botocore.exceptions.ClientError):
+                self.consumer.store_in_s3({'requestId': '1', 'widgetId': '1', 'owner': 'Test User'})
+
+        self.assertEqual(mock_put.call_count, 1)
+
+    def test_process_message_releases_message_abandoned_at_deadline(self):
+        self.consumer.shutdown = ShutdownController(drain_timeout=0)
+        self.consumer.shutdown.request_shutdown()
+        self.sqs.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps({'type': 'create', 'requestId': '1', 'widgetId': '1', 'owner': 'Test User'}))
+        message = self.consumer.get_messages_from_queue(max_messages=1)[0]
+        throttled = throttling_error('SlowDown', 'PutObject')
+        # Earlier throttling has already backed the limiter off
+        self.consumer.s3_limiter.backoff = 3
+
+        with patch.object(self.consumer.s3, 'put_object', side_effect=throttled):
+            self.assertFalse(self.consumer.process_message(message))
+
+        # Visible again straight away rather than after its visibility timeout
+        self.assertIn('Messages', self.sqs.receive_message(QueueUrl=self.queue_url))
+
+class TestShutdownController(unittest.TestCase):
+    def test_sigterm_requests_shutdown(self):
+        previous_handlers = signal.getsignal(signal.SIGTERM), signal.getsignal(signal.SIGINT)
+        controller = ShutdownController(drain_timeout=5)
+        try:
+            controller.install()
+            os.kill(os.getpid(), signal.SIGTERM)
+            repeat_handler = signal.getsignal(signal.SIGTERM)
+        finally:
+            signal.signal(signal.SIGTERM, previous_handlers[0])
+            signal.signal(signal.SIGINT, previous_handlers[1])
+
+        self.assertTrue(controller.requested)
+        self.assertFalse(controller.deadline_passed())
+        # A second SIGTERM takes the default action instead of being ignored
+        self.assertEqual(repeat_handler, signal.SIG_DFL)
+
+    def test_time_left_counts_down_to_zero(self):
+        controller = ShutdownController(drain_timeout=0)
+        self.assertIsNone(controller.time_left())
+        controller.request_shutdown()
+        self.assertEqual(controller.time_left(), 0)
+        self.assertTrue(controller.deadline_passed())
+
+class TestTokenBucket(unittest.TestCase):
+    @patch("consumer.consumer.time.sleep")
+    def test_acquire_waits_when_empty(self, mock_sleep):
+        bucket = TokenBucket(rate=2, capacity=2)
+        self.assertEqual(bucket.acquire(), 0)
+        self.assertEqual(bucket.acquire(), 0)
+
+        waited = bucket.acquire()
+        self.assertGreater(waited, 0)
+        mock_sleep.assert_called_once()
+
+    @patch("consumer.consumer.time.sleep")
+    def test_acquire_wait_capped_by_max_wait(self, mock_sleep):
+        bucket = TokenBucket(rate=1, capacity=1)
+        bucket.acquire()
+        bucket.throttled()
+        bucket.resume_at += 10
+
+        self.assertEqual(bucket.acquire(max_wait=0.5), 0.5)
+        mock_sleep.assert_called_once_with(0.5)
+
+    def test_unlimited_bucket_never_waits(self):
+        bucket = TokenBucket()
+        for _ in range(100):
+            self.assertEqual(bucket.acquire(), 0)
+
+    def test_throttled_then_recovers(self):
+        bucket = TokenBucket(rate=10)
+        bucket.throttled()
+        self.assertEqual(bucket.rate, 5)
+        self.assertEqual(bucket.pressure(), 0.5)
+
+        # A burst of successful writes doesn't undo the cut straight away
+        for _ in range(5):
+            bucket.succeeded()
+        self.assertAlmostEqual(bucket.rate, 5, places=1)
+        self.assertEqual(bucket.backoff, 0)
+
+        # The rate recovers by a tenth of the configured rate per second
+        bucket.last_adjusted -= 2
+        bucket.succeeded()
+        self.assertAlmostEqual(bucket.rate, 7, places=1)
+        bucket.last_adjusted -= 10
+        bucket.succeeded()
+        self.assertEqual(bucket.rate, 10)
             
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file